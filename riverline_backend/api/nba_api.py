@@ -24,16 +24,17 @@ def create_app(db_target: str):
                 password=os.getenv("CLICKHOUSE_PASSWORD")
             )
 
+    # One connector (and its HTTP session/pool) and one engine, with its OpenAI client,
+    # created at startup and shared by every request
+    connector = get_db_connector()
+    connector.connect()
+    nba_engine = NBAEngine(connector)
+
     @app.post("/predict_nba")
     async def predict_nba(request: NBARequest):
         customer_id = request.customer_id
             
         try:
-            connector = get_db_connector()
-            print('connector used is ',connector)
-            connector.connect()
-            
-            nba_engine = NBAEngine(connector)
             prediction = nba_engine.predict_for_customer(customer_id)
             
             return prediction
@@ -1,4 +1,5 @@
 
+import numpy as np
 import pandas as pd
 from .nba.nba_engine import NBAEngine
 import json
@@ -6,55 +7,37 @@ from typing import List, Dict
 
 def run_evaluation(db_connector, num_customers=1000):
     # 1. Fetch customer profiles and interactions
-    customer_profiles = db_connector.fetch_customer_profiles()
-    interactions = db_connector.fetch_interactions()
-
-    # Limit to num_customers for evaluation if needed
-    if num_customers and len(customer_profiles) > num_customers:
-        customer_profiles = customer_profiles[:num_customers]
-
-    # Group interactions by customer_id
-    customer_interactions = {}
-    for interaction in interactions:
-        customer_id = interaction.get('participant_external_id')
-        if customer_id not in customer_interactions:
-            customer_interactions[customer_id] = []
-        customer_interactions[customer_id].append(interaction)
+    # Limit to num_customers in the query, and only fetch those customers' interactions
+    customer_profiles = db_connector.fetch_customer_profiles(limit=num_customers or None)
+    interactions = db_connector.fetch_interactions(customer_ids=[customer_profile['customer_id'] for customer_profile in customer_profiles])
+
+    # Group interactions by customer_id, sorted by timestamp within each customer
+    interactions_df = pd.DataFrame(interactions)
+    if interactions_df.empty:
+        customer_interactions = {}
+        chat_log_by_customer = pd.Series(dtype=object)
+    else:
+        interactions_df = interactions_df.sort_values(['participant_external_id', 'interaction_timestamp'], kind='stable')
+        grouped = interactions_df.groupby('participant_external_id', sort=False)
+        customer_interactions = {customer_id: group.to_dict('records') for customer_id, group in grouped}
+        chat_lines = 'Customer: ' + interactions_df['content_text'].astype(str) + '\n' # Assuming all interactions are from customer for simplicity
+        chat_log_by_customer = chat_lines.groupby(interactions_df['participant_external_id'], sort=False).agg(''.join)
 
     # 2. Initialize the NBA engine
-    nba_engine = NBAEngine()
-
-    # 3. Generate NBA outputs for each customer
-    nba_outputs = []
-    chat_logs = []
-    issue_statuses = []
-
-    for customer_profile in customer_profiles:
-        customer_id = customer_profile.get('customer_id')
-        conversation_history = customer_interactions.get(customer_id, [])
-
-        # Generate NBA prediction
-        prediction = nba_engine.predict_action(customer_profile, conversation_history)
-        nba_outputs.append(prediction)
-
-        # Construct chat_log
-        chat_log_str = ""
-        for msg in sorted(conversation_history, key=lambda x: x['interaction_timestamp']):
-            chat_log_str += f"Customer: {msg['content_text']}\n" # Assuming all interactions are from customer for simplicity
-        chat_logs.append(chat_log_str)
+    nba_engine = NBAEngine(db_connector)
 
-        # Determine issue status based on the action
-        if prediction['channel'] == 'scheduling_phone_call':
-            issue_statuses.append('escalated')
-        elif prediction['channel'] == 'email_reply':
-            issue_statuses.append('pending_customer_reply')
-        else:
-            issue_statuses.append('resolved')
+    # 3. Generate NBA outputs for all customers in one batched call
+    conversation_histories = [customer_interactions.get(customer_profile.get('customer_id'), []) for customer_profile in customer_profiles]
+    nba_outputs = nba_engine.predict_actions_batch(customer_profiles, conversation_histories)
 
     # 4. Create a DataFrame and export to CSV
     df = pd.DataFrame(nba_outputs)
-    df['chat_log'] = chat_logs
-    df['issue_status'] = issue_statuses
+    df['chat_log'] = df['customer_id'].map(chat_log_by_customer).fillna('')
+    df['issue_status'] = np.select(
+        [df['channel'] == 'scheduling_phone_call', df['channel'] == 'email_reply'],
+        ['escalated', 'pending_customer_reply'],
+        default='resolved'
+    )
 
     # Reorder columns to match the specified format
     df = df[['customer_id', 'channel', 'send_time', 'message', 'reasoning', 'chat_log', 'issue_status']]
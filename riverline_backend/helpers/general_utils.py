@@ -0,0 +1,9 @@
+import os
+import uuid
+from typing import List
+
+
+def bulk_uuid4(n: int) -> List[str]:
+    # n random (version 4) UUID strings built from a single os.urandom read
+    random_bytes = os.urandom(16 * n)
+    return [str(uuid.UUID(bytes=random_bytes[i:i + 16], version=4)) for i in range(0, 16 * n, 16)]
@@ -9,20 +9,37 @@ from typing import List, Dict
 from fastapi import FastAPI
 
 load_dotenv() # Load environment variables from .env file
+import csv
 import uuid
 import pandas as pd
+import asyncio
 from pipeline.data_engine_factory import DataEngineFactory
+from pipeline.engines.spark_engine import SparkDataEngine
+from pyspark.sql.functions import count as spark_count, max as spark_max, lit
 from pipeline.connectors.supabase_connector import SupabaseConnector
 from pipeline.connectors.clickhouse_connector import ClickHouseConnector
 from nba.conversation_processor import ConversationProcessor
 from nba.nba_engine import NBAEngine
 
+# issue_status written to nba_predictions.csv for each predicted channel
+_STATUS_BY_CHANNEL = {
+    'scheduling_phone_call': 'escalated',
+}
+_DEFAULT_STATUS = 'pending_customer_response'
+
 class Pipeline:
     def __init__(self, config):
         self.config = config
-        self.data_engine = DataEngineFactory.get_engine(self.config) if 'data_file' in config else None
+        self._data_engine = None
         self.db_connector = self._get_db_connector()
 
+    @property
+    def data_engine(self):
+        # Built on first use so NBA/API actions never start a data engine (e.g. a SparkSession)
+        if self._data_engine is None and 'data_file' in self.config:
+            self._data_engine = DataEngineFactory.get_engine(self.config)
+        return self._data_engine
+
     def _get_db_connector(self):
         db_target = self.config['database']['target']
         if db_target == 'supabase':
@@ -36,6 +53,9 @@ class Pipeline:
                 port=os.environ.get("CLICKHOUSE_PORT"),
                 user=os.environ.get("CLICKHOUSE_USER"),
                 password=os.environ.get("CLICKHOUSE_PASSWORD"),
+                async_insert=os.environ.get("CLICKHOUSE_ASYNC_INSERT", "false").lower() == "true",
+                wait_for_async_insert=os.environ.get("CLICKHOUSE_WAIT_FOR_ASYNC_INSERT", "true").lower() == "true",
+                insert_parallelism=int(os.environ.get("CLICKHOUSE_INSERT_PARALLELISM", "1")),
             )
         else:
             raise ValueError(f"Unsupported database target: {db_target}")
@@ -50,6 +70,7 @@ class Pipeline:
         status = "running"
         error_message = None
         records_processed = 0
+        cached_df = None
 
         run_data = {
             "run_id": run_id,
@@ -71,12 +92,11 @@ class Pipeline:
             )
             print(f"Last watermark: {last_watermark}")
 
+            is_spark = isinstance(self.data_engine, SparkDataEngine)
+
             # 1. Read data
             df = self.data_engine.read_data(self.config['data_file'], last_watermark)
-            if self.data_engine.__class__.__name__ == "SparkDataEngine":
-                df_count = df.count()
-                print(f"DataFrame size after reading and filtering: {df_count}")
-            else:
+            if not is_spark:
                 print(f"DataFrame size after reading and filtering: {len(df)}")
 
             # 2. Normalize data
@@ -85,12 +105,18 @@ class Pipeline:
             # 3. Quality check
             df = self.data_engine.quality_check(df)
 
-            # 4. Get records
-            records = self.data_engine.get_records(df)
-            if self.data_engine.__class__.__name__ == "SparkDataEngine":
-                records_processed = df.count()
+            if is_spark:
+                # Cache the result so streaming the records below doesn't re-run the full read/normalize lineage,
+                # and get the row count and max timestamp together in one aggregation job
+                df = cached_df = df.cache()
+                stats = df.agg(spark_count(lit(1)).alias("records"), spark_max("interaction_timestamp").alias("latest_timestamp")).collect()[0]
+                print(f"DataFrame size after quality check: {stats['records']}")
+
+            # records have the same cardinality as df, so the count comes from the frame
+            if is_spark:
+                records_processed = stats['records']
             else:
-                records_processed = len(records)
+                records_processed = len(df)
 
             if records_processed > 0:
                 print('records length needed to be processed',records_processed)
@@ -101,14 +127,17 @@ class Pipeline:
                 # 6. Create tables if they don't exist
                 self.db_connector.create_tables()
 
-                # 7. Batch insert
-                self.db_connector.batch_insert(records)
+                # 7. Get records and batch insert them chunk by chunk, so peak memory is one chunk of dicts
+                for records in self.data_engine.get_records(df):
+                    self.db_connector.batch_insert(records)
 
                 # Update watermark
-                if self.data_engine.__class__.__name__ == "SparkDataEngine":
-                    latest_timestamp = df.agg({"interaction_timestamp": "max"}).collect()[0][0]
+                if is_spark:
+                    latest_timestamp = stats['latest_timestamp']
                 else:
-                    latest_timestamp = df['interaction_timestamp'].max()
+                    # Taken after quality_check so it only covers inserted rows; the fixed-width
+                    # '%Y-%m-%dT%H:%M:%SZ' strings sort chronologically, so the string max is the latest
+                    latest_timestamp = pd.Timestamp(df['interaction_timestamp'].max())
                 self.db_connector.update_watermark(
                     pipeline_name="data_ingestion",
                     platform_type="twitter",
@@ -123,6 +152,9 @@ class Pipeline:
             error_message = str(e)
             print(f"Pipeline run failed: {error_message}")
         finally:
+            # Release the cached frame's executor memory and disk once the run is over
+            if cached_df is not None:
+                cached_df.unpersist()
             end_time = datetime.now()
             end_data = {
                 "end_timestamp": end_time,
@@ -133,12 +165,12 @@ class Pipeline:
             self.db_connector.log_pipeline_run_end(run_id, end_data)
 
     def process_nba_data(self):
-        # 1. Fetch all interactions
-        interactions = self.db_connector.fetch_interactions()
+        # 1. Stream all interactions in chunks, with just the columns the processor aggregates
+        interaction_chunks = self.db_connector.iter_interactions_df(columns=['participant_external_id', 'interaction_timestamp'])
 
         # 2. Process interactions into conversations and customer profiles
         conversation_processor = ConversationProcessor()
-        processed_data = conversation_processor.process_interactions(interactions)
+        processed_data = conversation_processor.process_interaction_chunks(interaction_chunks)
 
         # 3. Insert into conversations table
         self.db_connector.batch_insert_conversations(processed_data['conversations'])
@@ -146,45 +178,41 @@ class Pipeline:
         # 4. Insert into customer_profiles table
         self.db_connector.batch_insert_customer_profiles(processed_data['customer_profiles'])
 
-    def run_nba_predictions(self, limit_customers=None):
-        # Efficient customer sampling (not fetch all!)
-        customer_profiles = self.db_connector.fetch_customer_profiles(limit=limit_customers)
+    def run_nba_predictions(self, limit_customers=None, max_concurrency=8):
+        # Efficient customer sampling (not fetch all!), with resolved issues filtered out by the database
+        customer_profiles = self.db_connector.fetch_customer_profiles(limit=limit_customers, exclude_resolved=True)
         
         nba_engine = NBAEngine(self.db_connector)
         all_customer_data = []
-        resolved_customers_count = 0
         
         print(f"Processing NBA predictions for {len(customer_profiles)} customers...")
-        
-        for i, customer_profile in enumerate(customer_profiles):
-            customer_id = customer_profile.get('customer_id')
-            
-            try:
-                conversation_summary = self.db_connector.fetch_customer_conversation(customer_id)
-                if not isinstance(conversation_summary, dict):
-                    conversation_summary = {}
-
-                if conversation_summary.get('resolution_status') == 'resolved':
-                    resolved_customers_count += 1
-                    continue # Skip resolved issues
-
-                conversation_history = self.db_connector.fetch_customer_interactions(customer_id)
-
-                prediction = nba_engine.predict_for_customer(customer_id)
-                all_customer_data.append({
-                    'prediction': prediction,
-                    'conversation_summary': conversation_summary,
-                    'conversation_history': conversation_history
-                })
-                
-                if (i + 1) % 100 == 0:
-                    print(f"Processed {i + 1}/{len(customer_profiles)} customers")
-                    
-            except Exception as e:
-                print(f"Error processing customer {customer_id}: {e}")
+
+        # Fetch all summaries and histories up front with chunked IN queries
+        customer_ids = [customer_profile.get('customer_id') for customer_profile in customer_profiles]
+        conversation_summaries = self.db_connector.fetch_customer_conversations_bulk(customer_ids)
+        conversation_histories = self.db_connector.fetch_customer_interactions_bulk(customer_ids)
+
+        # Predictions are bound by the LLM round trip, so keep up to max_concurrency of them in flight;
+        # failures come back as exceptions in customer order
+        predictions = asyncio.run(nba_engine.predict_actions_async(
+            customer_profiles,
+            [conversation_histories.get(customer_id, []) for customer_id in customer_ids],
+            [conversation_summaries.get(customer_id, {}) for customer_id in customer_ids],
+            max_concurrency=max_concurrency,
+            return_exceptions=True,
+            on_progress=self._print_prediction_progress
+        ))
+
+        for customer_id, prediction in zip(customer_ids, predictions):
+            if isinstance(prediction, Exception):
+                print(f"Error processing customer {customer_id}: {prediction}")
                 continue
-        
-        print(f"Skipped {resolved_customers_count} customers with 'resolved' issues.")
+
+            all_customer_data.append({
+                'prediction': prediction,
+                'conversation_summary': conversation_summaries.get(customer_id, {}),
+                'conversation_history': conversation_histories.get(customer_id, [])
+            })
 
         # Export results
         if all_customer_data:
@@ -193,47 +221,48 @@ class Pipeline:
         
         return all_customer_data
 
+    @staticmethod
+    def _print_prediction_progress(completed: int, total: int):
+        if completed % 100 == 0:
+            print(f"Processed {completed}/{total} customers")
+
     def export_predictions_csv(self, all_customer_data: List[Dict]):
         if not all_customer_data:
             print("No predictions to export.")
             return
 
-        processed_data = []
-
-        for item in all_customer_data:
-            prediction = item['prediction']
-            conversation_summary = item.get('conversation_summary', '')
-            conversation_history = item.get('conversation_history', [])
-
-            # Generate chat_log
-            chat_log = ""
-            if conversation_history:
-                for interaction in conversation_history:
-                    participant = interaction.get('participant_external_id', 'Unknown')
-                    content = interaction.get('content_text', '')
-                    chat_log += f"{participant}: {content}\n"
-
-            # Determine issue_status
-            issue_status = "pending_customer_response"  # Default
-            if prediction.get('channel') == 'scheduling_phone_call':
-                issue_status = "escalated"
-            # Add more rules for issue_status based on your logic
-
-            processed_data.append({
-                'customer_id': prediction.get('customer_id'),
-                'chat_log': chat_log.strip(),
-                'channel': prediction.get('channel'),
-                'message': prediction.get('message'),
-                'send_time': prediction.get('send_time'),
-                'reasoning': prediction.get('reasoning'),
-                'issue_status': issue_status
-            })
-
-        df = pd.DataFrame(processed_data)
         output_path = "nba_predictions.csv"
-        df.to_csv(output_path, index=False)
+        # Write each prediction row to disk as it is produced
+        with open(output_path, 'w', newline='', encoding='utf-8') as f:
+            writer = csv.DictWriter(f, fieldnames=['customer_id', 'chat_log', 'channel', 'message', 'send_time', 'reasoning', 'issue_status'],
+                                    lineterminator=os.linesep)
+            writer.writeheader()
+
+            for item in all_customer_data:
+                prediction = item['prediction']
+                conversation_history = item.get('conversation_history') or []
+
+                # Generate chat_log
+                chat_log = '\n'.join(f"{interaction.get('participant_external_id', 'Unknown')}: {interaction.get('content_text', '')}"
+                                     for interaction in conversation_history)
+
+                # Determine issue_status (add more rules to _STATUS_BY_CHANNEL)
+                issue_status = _STATUS_BY_CHANNEL.get(prediction.get('channel'), _DEFAULT_STATUS)
+
+                writer.writerow({
+                    'customer_id': prediction.get('customer_id'),
+                    'chat_log': chat_log.strip(),
+                    'channel': prediction.get('channel'),
+                    'message': prediction.get('message'),
+                    'send_time': prediction.get('send_time'),
+                    'reasoning': prediction.get('reasoning'),
+                    'issue_status': issue_status
+                })
         print(f"Predictions exported to {output_path}")
 
+    def close(self):
+        self.db_connector.close()
+
     def run_nba_api(self,port:int = 8080):
         """Start FastAPI server for single customer predictions"""
         import uvicorn
@@ -250,8 +279,8 @@ if __name__ == '__main__':
     import argparse
 
     parser = argparse.ArgumentParser(description="Run the Riverline data pipeline.")
-    parser.add_argument("--data_file", type=str, default="/home/arvind/personal-projects/riverline/backend/riverline_backend/data/10/twcs/twcs.csv",
-                        help="Path to the input CSV data file.")
+    parser.add_argument("--data_file", type=str, default=os.environ.get("DATA_FILE"),
+                        help="Path to the input CSV data file (defaults to the DATA_FILE environment variable).")
     parser.add_argument("--db", type=str, default="supabase", choices=["supabase", "clickhouse"],
                         help="Database target: 'supabase' or 'clickhouse'.")
     parser.add_argument("--action", type=str, default="run_pipeline",
@@ -263,19 +292,23 @@ if __name__ == '__main__':
     args = parser.parse_args()
 
     config = {
-        'data_file': args.data_file,
         'database': {
             'target': args.db
         }
     }
+    if args.data_file:
+        config['data_file'] = args.data_file
 
     pipeline = Pipeline(config)
 
-    if args.action == "run_pipeline":
-        pipeline.run()
-    elif args.action == "process_nba_data":
-        pipeline.process_nba_data()
-    elif args.action == "run_nba_predictions":
-        pipeline.run_nba_predictions(limit_customers=args.customers)
-    elif args.action == "run_nba_api":
-        pipeline.run_nba_api()
+    try:
+        if args.action == "run_pipeline":
+            pipeline.run()
+        elif args.action == "process_nba_data":
+            pipeline.process_nba_data()
+        elif args.action == "run_nba_predictions":
+            pipeline.run_nba_predictions(limit_customers=args.customers)
+        elif args.action == "run_nba_api":
+            pipeline.run_nba_api()
+    finally:
+        pipeline.close()
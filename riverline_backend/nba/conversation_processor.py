@@ -1,73 +1,93 @@
 
 import pandas as pd
-from typing import List, Dict
-import uuid
+from typing import List, Dict, Iterable
+
+from helpers.general_utils import bulk_uuid4
+
+# Buffered per-chunk stats rows that trigger a merge (more if the merged table is already larger)
+STATS_MERGE_ROWS = 1_000_000
+
+def _to_isoformat(timestamps: pd.Series) -> pd.Series:
+    # Vectorized Timestamp.isoformat(): '2017-10-31 22:10:47+00:00' -> '2017-10-31T22:10:47+00:00'
+    return timestamps.astype(str).str.replace(' ', 'T', n=1, regex=False)
 
 class ConversationProcessor:
     def __init__(self):
         pass
 
-    def process_interactions(self, interactions: List[Dict]) -> Dict[str, List[Dict]]:
-        df = pd.DataFrame(interactions)
+    def process_interaction_chunks(self, chunks: Iterable[pd.DataFrame]) -> Dict[str, List[Dict]]:
+        # Per-chunk stats are buffered and merged into one row per customer only once the buffer
+        # outgrows both STATS_MERGE_ROWS and the merged table, so memory stays bounded and each
+        # stats row is re-grouped a bounded number of times however small the chunks are
+        partial_stats = []
+        merged_rows = 0
+        buffered_rows = 0
+        for chunk in chunks:
+            chunk_stats = self._conversation_stats(chunk)
+            partial_stats.append(chunk_stats)
+            buffered_rows += len(chunk_stats)
+            if buffered_rows >= max(STATS_MERGE_ROWS, merged_rows):
+                partial_stats = [self._merge_stats(partial_stats)]
+                merged_rows = len(partial_stats[0])
+                buffered_rows = 0
+        if not partial_stats:
+            return {'conversations': [], 'customer_profiles': []}
+        return self._build_records(self._merge_stats(partial_stats))
+
+    def _merge_stats(self, partial_stats: List[pd.DataFrame]) -> pd.DataFrame:
+        if len(partial_stats) == 1:
+            return partial_stats[0]
+        return pd.concat(partial_stats).groupby(level=0).agg({'min': 'min', 'max': 'max', 'size': 'sum'})
 
-        # Convert timestamp to datetime objects for easier manipulation
-        df['interaction_timestamp'] = pd.to_datetime(df['interaction_timestamp'])
+    def _conversation_stats(self, df: pd.DataFrame) -> pd.DataFrame:
+        # Convert timestamp to datetime objects for easier manipulation. utc=True puts naive
+        # datetime64 columns and offset-suffixed strings on one tz-aware UTC scale, so chunks
+        # from either connector aggregate together; ISO8601 parses the strings in one pass
+        interaction_timestamps = pd.to_datetime(df['interaction_timestamp'], format='ISO8601', utc=True, cache=True)
 
-        # Sort by customer_id and timestamp to ensure correct conversation flow
-        df = df.sort_values(by=['participant_external_id', 'interaction_timestamp'])
+        # One groupby pass over the timestamps computes every per-customer aggregate
+        return interaction_timestamps.groupby(df['participant_external_id']).agg(['min', 'max', 'size'])
 
-        conversations_data = []
-        customer_profiles_data = []
+    def _build_records(self, conversation_stats: pd.DataFrame) -> Dict[str, List[Dict]]:
+        # Both tables are built column-wise from the aggregates, one row per customer
+        n = len(conversation_stats)
+        customer_ids = conversation_stats.index.to_numpy()
+        total_interactions = conversation_stats['size'].to_numpy()
+        conversation_start_timestamps = _to_isoformat(conversation_stats['min']).to_numpy()
+        conversation_end_timestamps = _to_isoformat(conversation_stats['max']).to_numpy()
+        created_at = pd.Timestamp.now(tz='UTC').isoformat()
 
-        # Group by customer_id to process conversations
-        for customer_id, group in df.groupby('participant_external_id'):
-            # Conversation aggregation
-            conversation_id = str(uuid.uuid4())
-            conversation_start_timestamp = group['interaction_timestamp'].min()
-            conversation_end_timestamp = group['interaction_timestamp'].max()
-            total_interactions = len(group)
-            
-            # For hackathon MVP, set default values for resolution_status, sentiment, topic, channel_mix
-            # These would be determined by more sophisticated ML models in a full system
-            resolution_status = 'open'
-            customer_sentiment_score = 0.0 # Neutral
-            conversation_topic = 'general_inquiry'
-            channel_mix = {'twitter': True} # Assuming all from twitter for now
+        # For hackathon MVP, set default values for resolution_status, sentiment, topic, channel_mix
+        # These would be determined by more sophisticated ML models in a full system
+        conversations = pd.DataFrame({
+            'conversation_id': bulk_uuid4(n),
+            'customer_id': customer_ids,
+            'brand_account_id': 'Riverline', # Placeholder
+            'conversation_start_timestamp': conversation_start_timestamps,
+            'conversation_end_timestamp': conversation_end_timestamps,
+            'total_interactions': total_interactions,
+            'resolution_status': 'open',
+            'customer_sentiment_score': 0.0, # Neutral
+            'conversation_topic': 'general_inquiry',
+            'channel_mix': [{'twitter': True} for _ in range(n)], # Assuming all from twitter for now
+            'created_at': created_at
+        })
 
-            conversations_data.append({
-                'conversation_id': conversation_id,
-                'customer_id': customer_id,
-                'brand_account_id': 'Riverline', # Placeholder
-                'conversation_start_timestamp': conversation_start_timestamp.isoformat(),
-                'conversation_end_timestamp': conversation_end_timestamp.isoformat(),
-                'total_interactions': total_interactions,
-                'resolution_status': resolution_status,
-                'customer_sentiment_score': customer_sentiment_score,
-                'conversation_topic': conversation_topic,
-                'channel_mix': channel_mix,
-                'created_at': pd.Timestamp.now(tz='UTC').isoformat()
-            })
+        # Customer profile aggregation
+        customer_profiles = pd.DataFrame({
+            'customer_id': customer_ids,
+            'platform_accounts': [{'twitter_id': customer_id} for customer_id in customer_ids], # Placeholder
+            'interaction_history_summary': [{'total_interactions': int(count)} for count in total_interactions], # Placeholder
+            'behavioral_tags': [{'default': True} for _ in range(n)], # Placeholder
+            'preferred_channels': [{'twitter': True} for _ in range(n)], # Placeholder
+            'avg_response_time': 0.0, # Placeholder
+            'total_conversations': 1, # For this single conversation
+            'resolution_rate': 0.0, # Placeholder
+            'last_interaction_timestamp': conversation_end_timestamps,
+            'created_at': created_at
+        })
 
-            # Customer profile aggregation
-            total_conversations = 1 # For this single conversation
-            avg_response_time = 0.0 # Placeholder
-            resolution_rate = 0.0 # Placeholder
-            last_interaction_timestamp = conversation_end_timestamp.isoformat()
-            
-            customer_profiles_data.append({
-                'customer_id': customer_id,
-                'platform_accounts': {'twitter_id': customer_id}, # Placeholder
-                'interaction_history_summary': {'total_interactions': total_interactions}, # Placeholder
-                'behavioral_tags': {'default': True}, # Placeholder
-                'preferred_channels': {'twitter': True}, # Placeholder
-                'avg_response_time': avg_response_time,
-                'total_conversations': total_conversations,
-                'resolution_rate': resolution_rate,
-                'last_interaction_timestamp': last_interaction_timestamp,
-                'created_at': pd.Timestamp.now(tz='UTC').isoformat()
-            })
-        
         return {
-            'conversations': conversations_data,
-            'customer_profiles': customer_profiles_data
+            'conversations': conversations.to_dict('records'),
+            'customer_profiles': customer_profiles.to_dict('records')
         }
@@ -1,4 +1,5 @@
-from typing import List, Dict
+from typing import List, Dict, Optional, Callable
+import asyncio
 from decimal import Decimal
 from datetime import datetime, timedelta, timezone
 
@@ -8,7 +9,7 @@ from .nba_rules import determine_channel_and_timing, extract_simple_features
 from pipeline.connectors.supabase_connector import SupabaseConnector
 from pipeline.connectors.clickhouse_connector import ClickHouseConnector
 import os
-from openai import AzureOpenAI
+from openai import AzureOpenAI, AsyncAzureOpenAI
 from openai.types import ResponseFormatJSONObject
 import json
 import re
@@ -31,7 +32,7 @@ class NBAEngine:
             return float(obj)
         return obj
 
-    def _enhance_with_llm(self, rule_output: Dict, conversation_context: Dict,customer_id, conversation_history: List[Dict]) -> Dict:
+    def _build_llm_prompt(self, rule_output: Dict, conversation_context: Dict,customer_id, conversation_history: List[Dict]) -> str:
         # Convert any Decimal objects in conversation_context to floats
         processed_conversation_context = self._convert_decimals_to_floats(conversation_context)
 
@@ -71,15 +72,27 @@ class NBAEngine:
             "reasoning": "Detailed and crisp explanation of the decision, highlighting key factors from the conversation and customer behavior."
         }}
         """
-        
+        return prompt
+
+    def _enhance_with_llm(self, rule_output: Dict, conversation_context: Dict,customer_id, conversation_history: List[Dict]) -> Dict:
+        prompt = self._build_llm_prompt(rule_output, conversation_context, customer_id, conversation_history)
         response = self.openai_client.chat.completions.create(
             model=os.getenv("AZURE_OPENAI_DEPLOYMENT_NAME"),
             messages=[{"role": "user", "content": prompt}],
             response_format=ResponseFormatJSONObject(type="json_object")
         )
-            # response_format={{ "type": "json_object" }}
-        llm_response_content = response.choices[0].message.content
+        return self._parse_llm_response(rule_output, response.choices[0].message.content)
+
+    async def _enhance_with_llm_async(self, openai_client, rule_output: Dict, conversation_context: Dict,customer_id, conversation_history: List[Dict]) -> Dict:
+        prompt = self._build_llm_prompt(rule_output, conversation_context, customer_id, conversation_history)
+        response = await openai_client.chat.completions.create(
+            model=os.getenv("AZURE_OPENAI_DEPLOYMENT_NAME"),
+            messages=[{"role": "user", "content": prompt}],
+            response_format=ResponseFormatJSONObject(type="json_object")
+        )
+        return self._parse_llm_response(rule_output, response.choices[0].message.content)
 
+    def _parse_llm_response(self, rule_output: Dict, llm_response_content: str) -> Dict:
         try:
             parsed_response = json.loads(llm_response_content)
             enhanced_message = parsed_response.get("message", "")
@@ -105,20 +118,70 @@ class NBAEngine:
             conversation_summary = {} # Ensure it's a dictionary
 
         conversation_history = self.db_connector.fetch_customer_interactions(customer_id)
-        conversation_summary = self.db_connector.fetch_customer_conversation(customer_id)
-        if not isinstance(conversation_summary, dict):
-            conversation_summary = {} # Ensure it's a dictionary
         print('data fetch done for customer ', customer_id)
-        # 1. Feature Extraction
-        features = extract_simple_features(customer_id, conversation_history)
+        return self._predict(customer_id, customer_profile, conversation_summary, conversation_history)
+
+    def predict_actions_batch(self, customer_profiles: List[Dict], conversation_histories: List[List[Dict]], max_concurrency: int = 8) -> List[Dict]:
+        return asyncio.run(self.predict_actions_async(customer_profiles, conversation_histories, max_concurrency=max_concurrency))
+
+    async def _predict_action_async(self, openai_client, customer_profile: Dict, conversation_history: List[Dict], conversation_summary: Optional[Dict] = None) -> Dict:
+        customer_id = customer_profile.get('customer_id')
+        rule_output = self._rule_decision(customer_id, customer_profile, conversation_history)
+        enhanced_output = await self._enhance_with_llm_async(openai_client, rule_output, conversation_summary or {}, customer_id, conversation_history)
+        return self._combine(customer_id, rule_output, enhanced_output)
+
+    async def predict_actions_async(self, customer_profiles: List[Dict], conversation_histories: List[List[Dict]],
+                                    conversation_summaries: Optional[List[Dict]] = None, max_concurrency: int = 8,
+                                    return_exceptions: bool = False,
+                                    on_progress: Optional[Callable[[int, int], None]] = None) -> List:
+        # Each prediction is dominated by the LLM round trip: keep up to max_concurrency requests
+        # in flight on one async client; results come back in the same order as customer_profiles
+        if conversation_summaries is None:
+            conversation_summaries = [None] * len(customer_profiles)
+        semaphore = asyncio.Semaphore(max_concurrency)
+        completed = 0
+
+        async def bounded_predict(customer_profile, conversation_history, conversation_summary):
+            nonlocal completed
+            async with semaphore:
+                try:
+                    return await self._predict_action_async(openai_client, customer_profile, conversation_history, conversation_summary)
+                finally:
+                    # on_progress(completed, total) fires as each prediction finishes, successful or not
+                    completed += 1
+                    if on_progress:
+                        on_progress(completed, len(customer_profiles))
+
+        # The async client's connection pool belongs to the running event loop, so it is
+        # opened and closed here, once per batch
+        async with AsyncAzureOpenAI(
+            api_key=os.getenv("AZURE_OPENAI_API_KEY"),
+            api_version="2024-02-01",
+            azure_endpoint=os.getenv("AZURE_OPENAI_ENDPOINT")
+        ) as openai_client:
+            return await asyncio.gather(
+                *(bounded_predict(customer_profile, conversation_history, conversation_summary)
+                  for customer_profile, conversation_history, conversation_summary
+                  in zip(customer_profiles, conversation_histories, conversation_summaries)),
+                return_exceptions=return_exceptions
+            )
 
-        # 2. Rule-based Decision
-        rule_output = determine_channel_and_timing(customer_profile, conversation_history)
+    def _predict(self, customer_id: str, customer_profile: Dict, conversation_summary: Dict, conversation_history: List[Dict]) -> Dict:
+        rule_output = self._rule_decision(customer_id, customer_profile, conversation_history)
 
-        print( )
         # 3. LLM Enhancement
         enhanced_output = self._enhance_with_llm(rule_output, conversation_summary,customer_id, conversation_history)
 
+        return self._combine(customer_id, rule_output, enhanced_output)
+
+    def _rule_decision(self, customer_id: str, customer_profile: Dict, conversation_history: List[Dict]) -> Dict:
+        # 1. Feature Extraction
+        features = extract_simple_features(customer_id, conversation_history)
+
+        # 2. Rule-based Decision
+        return determine_channel_and_timing(customer_profile, conversation_history)
+
+    def _combine(self, customer_id: str, rule_output: Dict, enhanced_output: Dict) -> Dict:
         # Combine results
         prediction = {
             "customer_id": customer_id,
@@ -127,4 +190,4 @@ class NBAEngine:
             "message": enhanced_output['message'],
             "reasoning": enhanced_output['reasoning']
         }
-        return prediction
\ No newline at end of file
+        return prediction
@@ -1,28 +1,37 @@
-from typing import Dict, List
+from typing import Dict, List, Optional
 from datetime import datetime, timedelta
+from functools import lru_cache
 import re
 
-def calculate_hours_ago(timestamp_str: str) -> float:
+# Keyword scans compiled once: one case-insensitive pass per message over all keywords
+# (substring matches: 'now' also matches 'know')
+URGENT_KEYWORDS_PATTERN = re.compile('urgent|asap|immediately|now|help', re.IGNORECASE)
+ESCALATION_KEYWORDS_PATTERN = re.compile('escalate|manager|complaint|unacceptable', re.IGNORECASE)
+
+@lru_cache(maxsize=65536)
+def _parse_ts(timestamp_str: str) -> datetime:
+    """Parses a timestamp string, memoized since the same timestamps are re-parsed across rules."""
+    # Handle both ISO format and ClickHouse DateTime64 format
+    if 'T' in timestamp_str:
+        return datetime.fromisoformat(timestamp_str)
+    return datetime.strptime(timestamp_str, '%Y-%m-%d %H:%M:%S.%f')
+
+def calculate_hours_ago(timestamp_str: str, now: Optional[datetime] = None) -> float:
     """Calculates hours since a given timestamp string."""
     if not timestamp_str:
         return 0.0
     try:
-        # Handle both ISO format and ClickHouse DateTime64 format
-        if 'T' in timestamp_str:
-            dt_object = datetime.fromisoformat(timestamp_str)
-        else:
-            dt_object = datetime.strptime(timestamp_str, '%Y-%m-%d %H:%M:%S.%f')
-        
-        time_difference = datetime.now() - dt_object
+        time_difference = (now or datetime.now()) - _parse_ts(timestamp_str)
         return time_difference.total_seconds() / 3600
     except ValueError:
         return 0.0
 
-def count_interactions_last_24h(conversation_history: List[Dict]) -> int:
+def count_interactions_last_24h(conversation_history: List[Dict], now: Optional[datetime] = None) -> int:
     """Counts interactions within the last 24 hours."""
+    now = now or datetime.now()
     count = 0
     for interaction in conversation_history:
-        if 'interaction_timestamp' in interaction and calculate_hours_ago(interaction['interaction_timestamp']) <= 24:
+        if 'interaction_timestamp' in interaction and calculate_hours_ago(interaction['interaction_timestamp'], now) <= 24:
             count += 1
     return count
 
@@ -31,10 +40,10 @@ def count_conversation_turns(interactions_data: List[Dict]) -> int:
     return len(interactions_data)
 
 def hours_since_last_message(interactions_data: List[Dict]) -> float:
-    """Calculates hours since the last message in interactions data."""
+    """Calculates hours since the last message in interactions data (sorted by interaction_timestamp)."""
     if not interactions_data:
         return 0.0
-    last_interaction = max(interactions_data, key=lambda x: x.get('interaction_timestamp', ''))
+    last_interaction = interactions_data[-1]
     return calculate_hours_ago(last_interaction.get('interaction_timestamp', ''))
 
 def calculate_avg_message_length(interactions_data: List[Dict]) -> float:
@@ -46,19 +55,11 @@ def calculate_avg_message_length(interactions_data: List[Dict]) -> float:
 
 def check_urgent_words(interactions_data: List[Dict]) -> bool:
     """Checks for urgent keywords in messages."""
-    urgent_keywords = ["urgent", "asap", "immediately", "now", "help"]
-    for interaction in interactions_data:
-        if any(keyword in interaction.get('content_text', '').lower() for keyword in urgent_keywords):
-            return True
-    return False
+    return any(URGENT_KEYWORDS_PATTERN.search(interaction.get('content_text', '')) for interaction in interactions_data)
 
 def check_escalation_words(interactions_data: List[Dict]) -> bool:
     """Checks for escalation keywords in messages."""
-    escalation_keywords = ["escalate", "manager", "complaint", "unacceptable"]
-    for interaction in interactions_data:
-        if any(keyword in interaction.get('content_text', '').lower() for keyword in escalation_keywords):
-            return True
-    return False
+    return any(ESCALATION_KEYWORDS_PATTERN.search(interaction.get('content_text', '')) for interaction in interactions_data)
 
 def analyze_response_pattern(interactions_data: List[Dict]) -> str:
     """Analyzes the response pattern (simple)."""
@@ -78,6 +79,7 @@ def analyze_response_pattern(interactions_data: List[Dict]) -> str:
 
 def determine_channel_and_timing(customer_profile: Dict, conversation_history: List[Dict]) -> Dict:
     """Determines the best channel and timing based on rules."""
+    now = datetime.now()
     # Rule 1: Long conversations → Phone Call
     if len(conversation_history) > 5:
         return {
@@ -89,8 +91,9 @@ def determine_channel_and_timing(customer_profile: Dict, conversation_history: L
     if conversation_history:
         customer_interactions = [i for i in conversation_history if i.get('participant_external_id') == customer_profile.get('customer_id')]
         if customer_interactions:
-            last_customer_interaction = max(customer_interactions, key=lambda x: x.get('interaction_timestamp', ''))
-            hours_since_last_customer_interaction = calculate_hours_ago(last_customer_interaction.get('interaction_timestamp', ''))
+            # conversation_history is sorted by interaction_timestamp, and filtering keeps that order
+            last_customer_interaction = customer_interactions[-1]
+            hours_since_last_customer_interaction = calculate_hours_ago(last_customer_interaction.get('interaction_timestamp', ''), now)
             
             if hours_since_last_customer_interaction > 24:
                 return {
@@ -99,7 +102,7 @@ def determine_channel_and_timing(customer_profile: Dict, conversation_history: L
                 }
     
     # Rule 3: High interaction frequency → Twitter reply (customer is active)
-    recent_interactions = count_interactions_last_24h(conversation_history)
+    recent_interactions = count_interactions_last_24h(conversation_history, now)
     if recent_interactions >= 3:
         return {
             'channel': 'twitter_dm_reply', 
@@ -1,21 +1,75 @@
-from typing import List, Dict, Optional
+from typing import List, Dict, Optional, Iterator
+from concurrent.futures import ThreadPoolExecutor
 import clickhouse_connect
+import pandas as pd
 import json
+import threading
 from datetime import datetime
 import uuid
 from .db_connector import DatabaseConnector
 
 
+INTERACTION_COLUMNS = [
+    'interaction_id', 'external_id', 'platform_type', 'participant_external_id',
+    'content_text', 'content_metadata', 'interaction_timestamp', 'parent_interaction_id',
+    'platform_metadata', 'processing_metadata', 'created_at'
+]
+
+# Customer ids per IN (...) query in the bulk fetch methods
+BULK_FETCH_CHUNK_SIZE = 1000
+
+
+def _to_clickhouse_value(value):
+    # Datetimes go over the wire as ISO strings and dicts as JSON strings
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, dict):
+        return json.dumps(value)
+    return value
+
+
 class ClickHouseConnector(DatabaseConnector):
-    def __init__(self, host: str, port: int, user: str, password: str):
-        self.client = clickhouse_connect.get_client(host=host, port=port, user=user, password=password)
+    def __init__(self, host: str, port: int, user: str, password: str,
+                 async_insert: bool = False, wait_for_async_insert: bool = True,
+                 insert_parallelism: int = 1):
+        self._client_kwargs = {'host': host, 'port': port, 'user': user, 'password': password}
+        self.client = clickhouse_connect.get_client(**self._client_kwargs)
+        # Interaction inserts are split across this many worker threads, each with its own client
+        # (a clickhouse-connect client/session cannot run concurrent queries)
+        self.insert_parallelism = max(1, insert_parallelism)
+        self._insert_executor = None
+        self._worker_local = threading.local()
+        # Every worker client, so close() can reach the ones held in other threads' locals
+        self._worker_clients = []
+        self._worker_clients_lock = threading.Lock()
+        # table -> {column name: ClickHouse type name}, filled by one DESCRIBE per table
+        self._column_types = {}
+        # Server-side insert buffering: ClickHouse coalesces batches into fewer, larger parts.
+        # With wait_for_async_insert disabled the insert returns before the buffer is flushed.
+        self.insert_settings = {}
+        if async_insert:
+            self.insert_settings = {
+                'async_insert': 1,
+                'wait_for_async_insert': int(wait_for_async_insert),
+                'async_insert_busy_timeout_ms': 1000,
+                'async_insert_max_data_size': 10_000_000,
+            }
 
     def connect(self) -> bool:
         return self.client.ping()
 
+    def _get_column_type_names(self, table: str, column_names: List[str]) -> List[str]:
+        # Without explicit column types clickhouse-connect runs DESCRIBE TABLE before every insert
+        if table not in self._column_types:
+            result = self.client.query(f'DESCRIBE TABLE {table}')
+            self._column_types[table] = {row[0]: row[1] for row in result.result_rows}
+        table_types = self._column_types[table]
+        return [table_types[name] for name in column_names]
+
     def create_tables(self) -> bool:
         try:
-            self.client.command('''
+            table_ddls = {
+                'interactions': '''
             CREATE TABLE IF NOT EXISTS interactions (
                 interaction_id String,
                 external_id String,
@@ -32,8 +86,8 @@ class ClickHouseConnector(DatabaseConnector):
             ENGINE = MergeTree()
             PARTITION BY toYYYYMM(interaction_timestamp)
             ORDER BY (platform_type, interaction_timestamp, external_id)
-            ''')
-            self.client.command('''
+            ''',
+                'ingestion_watermarks': '''
             CREATE TABLE IF NOT EXISTS ingestion_watermarks (
                 id String,
                 pipeline_name String,
@@ -46,8 +100,8 @@ class ClickHouseConnector(DatabaseConnector):
             )
             ENGINE = MergeTree()
             ORDER BY (pipeline_name, platform_type, updated_at)
-            ''')
-            self.client.command('''
+            ''',
+                'pipeline_runs': '''
             CREATE TABLE IF NOT EXISTS pipeline_runs (
                 run_id String,
                 pipeline_name String,
@@ -63,8 +117,8 @@ class ClickHouseConnector(DatabaseConnector):
             )
             ENGINE = MergeTree()
             ORDER BY (start_timestamp, run_id)
-            ''')
-            self.client.command('''
+            ''',
+                'conversations': '''
             CREATE TABLE IF NOT EXISTS conversations (
                 conversation_id String,
                 customer_id String,
@@ -80,8 +134,8 @@ class ClickHouseConnector(DatabaseConnector):
             )
             ENGINE = MergeTree()
             ORDER BY (conversation_start_timestamp, customer_id)
-            ''')
-            self.client.command('''
+            ''',
+                'customer_profiles': '''
             CREATE TABLE IF NOT EXISTS customer_profiles (
                 customer_id String,
                 platform_accounts String,
@@ -96,7 +150,13 @@ class ClickHouseConnector(DatabaseConnector):
             )
             ENGINE = MergeTree()
             ORDER BY (customer_id, created_at)
-            ''')
+            ''',
+            }
+            # One round trip lists the existing tables; DDL is only sent for the missing ones
+            existing_tables = {row[0] for row in self.client.query('SHOW TABLES').result_rows}
+            for table, ddl in table_ddls.items():
+                if table not in existing_tables:
+                    self.client.command(ddl)
             return True
         except Exception as e:
             print(f"Error creating tables: {e}")
@@ -104,47 +164,18 @@ class ClickHouseConnector(DatabaseConnector):
 
     def batch_insert(self, records: List[Dict]) -> bool:
         try:
-            # Convert datetime objects and dicts to string for ClickHouse
-            processed_records = []
-            for record in records:
-                processed_record = record.copy()
-                processed_record['content_metadata'] = json.dumps(processed_record.get('content_metadata', {}))
-                processed_record['platform_metadata'] = json.dumps(processed_record.get('platform_metadata', {}))
-                processed_record['processing_metadata'] = json.dumps(processed_record.get('processing_metadata', {}))
-                processed_record['interaction_id'] = str(processed_record.get('interaction_id', ''))
-                processed_record['external_id'] = str(processed_record.get('external_id', ''))
-                processed_record['participant_external_id'] = str(processed_record.get('participant_external_id', ''))
-                processed_record['parent_interaction_id'] = str(processed_record.get('parent_interaction_id', ''))
-                processed_record['created_at'] = processed_record.get('created_at', datetime.now())
-
-                for key, value in processed_record.items():
-                    if isinstance(value, datetime):
-                        processed_record[key] = value.isoformat()
-                    elif isinstance(value, dict):
-                        processed_record[key] = json.dumps(value)
-                processed_records.append(processed_record)
-            column_names = [
-                'interaction_id', 'external_id', 'platform_type', 'participant_external_id',
-                'content_text', 'content_metadata', 'interaction_timestamp', 'parent_interaction_id',
-                'platform_metadata', 'processing_metadata', 'created_at'
-            ]
-            data_to_insert = []
-            for record in processed_records:
-                row = [
-                    record.get('interaction_id'),
-                    record.get('external_id'),
-                    record.get('platform_type'),
-                    record.get('participant_external_id'),
-                    record.get('content_text', ''),
-                    record.get('content_metadata'),
-                    record.get('interaction_timestamp'),
-                    record.get('parent_interaction_id'),
-                    record.get('platform_metadata'),
-                    record.get('processing_metadata'),
-                    record.get('created_at')
-                ]
-                data_to_insert.append(row)
-            self.client.insert('interactions', data_to_insert, column_names=column_names)
+            # Resolved here on the shared client, before any worker thread starts inserting
+            column_type_names = self._get_column_type_names('interactions', INTERACTION_COLUMNS)
+            if self.insert_parallelism > 1 and len(records) > self.insert_parallelism:
+                # One slice per worker; map() blocks until every slice is inserted and re-raises failures.
+                # Each slice is its own INSERT, so a failure can leave the other slices committed:
+                # a retry of the same records may then insert those rows twice.
+                slice_size = -(-len(records) // self.insert_parallelism)
+                slices = [records[i:i + slice_size] for i in range(0, len(records), slice_size)]
+                list(self._get_insert_executor().map(
+                    lambda batch: self._insert_interactions_on_worker(batch, column_type_names), slices))
+            else:
+                self._insert_interactions(self.client, records, column_type_names)
             return True
         except Exception as e:
             print(f"Error batch inserting records: {e}")
@@ -152,10 +183,59 @@ class ClickHouseConnector(DatabaseConnector):
             traceback.print_exc()
             return False
 
+    def _get_insert_executor(self) -> ThreadPoolExecutor:
+        if self._insert_executor is None:
+            self._insert_executor = ThreadPoolExecutor(max_workers=self.insert_parallelism,
+                                                       thread_name_prefix='clickhouse-insert')
+        return self._insert_executor
+
+    def _insert_interactions_on_worker(self, records: List[Dict], column_type_names: List[str]):
+        client = getattr(self._worker_local, 'client', None)
+        if client is None:
+            client = clickhouse_connect.get_client(**self._client_kwargs)
+            self._worker_local.client = client
+            with self._worker_clients_lock:
+                self._worker_clients.append(client)
+        self._insert_interactions(client, records, column_type_names)
+
+    def _insert_interactions(self, client, records: List[Dict], column_type_names: List[str]):
+        # Default created_at for the whole batch, read from the clock once
+        now = datetime.now()
+        # Build the payload column by column (same order as INTERACTION_COLUMNS) and send it
+        # column-oriented, the layout clickhouse-connect serializes directly
+        data_to_insert = [
+            [str(record.get('interaction_id', '')) for record in records],
+            [str(record.get('external_id', '')) for record in records],
+            [_to_clickhouse_value(record.get('platform_type')) for record in records],
+            [str(record.get('participant_external_id', '')) for record in records],
+            [_to_clickhouse_value(record.get('content_text', '')) for record in records],
+            [json.dumps(record.get('content_metadata', {})) for record in records],
+            [_to_clickhouse_value(record.get('interaction_timestamp')) for record in records],
+            [str(record.get('parent_interaction_id', '')) for record in records],
+            [json.dumps(record.get('platform_metadata', {})) for record in records],
+            [json.dumps(record.get('processing_metadata', {})) for record in records],
+            [_to_clickhouse_value(record.get('created_at', now)) for record in records],
+        ]
+        client.insert('interactions', data_to_insert, column_names=INTERACTION_COLUMNS,
+                      column_type_names=column_type_names, column_oriented=True, settings=self.insert_settings)
+
+    def close(self):
+        # Wait for in-flight inserts before closing the clients they run on
+        if self._insert_executor is not None:
+            self._insert_executor.shutdown(wait=True)
+            self._insert_executor = None
+        with self._worker_clients_lock:
+            for client in self._worker_clients:
+                client.close()
+            self._worker_clients = []
+        self._worker_local = threading.local()
+        self.client.close()
+
     def get_last_watermark(self, pipeline_name: str, platform_type: str) -> Optional[str]:
         try:
             result = self.client.query(
-                f"SELECT last_processed_timestamp FROM ingestion_watermarks WHERE pipeline_name = '{pipeline_name}' AND platform_type = '{platform_type}' ORDER BY updated_at DESC LIMIT 1"
+                "SELECT last_processed_timestamp FROM ingestion_watermarks WHERE pipeline_name = {pipeline_name:String} AND platform_type = {platform_type:String} ORDER BY updated_at DESC LIMIT 1",
+                parameters={'pipeline_name': pipeline_name, 'platform_type': platform_type}
             )
             if result.row_count > 0:
                 return result.first_row[0].isoformat()
@@ -182,7 +262,8 @@ class ClickHouseConnector(DatabaseConnector):
                 status,
                 datetime.now().isoformat()
             ]
-            self.client.insert('ingestion_watermarks', [data_to_insert], column_names=column_names)
+            self.client.insert('ingestion_watermarks', [data_to_insert], column_names=column_names,
+                               column_type_names=self._get_column_type_names('ingestion_watermarks', column_names))
             return True
         except Exception as e:
             print(f"Error updating watermark in ClickHouse: {e}")
@@ -222,7 +303,8 @@ class ClickHouseConnector(DatabaseConnector):
                 processed_run_data.get('created_at')
             ]
             print(f"Attempting to insert into pipeline_runs: data={data_to_insert}, columns={column_names}")
-            insert_result = self.client.insert('pipeline_runs', [data_to_insert], column_names=column_names)
+            insert_result = self.client.insert('pipeline_runs', [data_to_insert], column_names=column_names,
+                                               column_type_names=self._get_column_type_names('pipeline_runs', column_names))
             print(f"Insert result for pipeline_runs: {insert_result}")
             return run_data['run_id']
         except Exception as e:
@@ -240,7 +322,8 @@ class ClickHouseConnector(DatabaseConnector):
 
             # Fetch the original run data to merge with end_data
             original_run_data_result = self.client.query(
-                f"SELECT * FROM pipeline_runs WHERE run_id = '{run_id}' ORDER BY created_at DESC LIMIT 1")
+                "SELECT * FROM pipeline_runs WHERE run_id = {run_id:String} ORDER BY created_at DESC LIMIT 1",
+                parameters={'run_id': run_id})
 
             if original_run_data_result.result_rows:
                 columns = original_run_data_result.column_names
@@ -283,7 +366,8 @@ class ClickHouseConnector(DatabaseConnector):
                     str(merged_data.get('config_snapshot', '')),
                     merged_data.get('created_at')
                 ]
-                self.client.insert('pipeline_runs', [data_to_insert], column_names=column_names)
+                self.client.insert('pipeline_runs', [data_to_insert], column_names=column_names,
+                                   column_type_names=self._get_column_type_names('pipeline_runs', column_names))
             else:
                 print(f"Warning: Original run data not found for run_id {run_id}. Inserting end data as new record.")
                 # If original not found, create a new record with available end_data and run_id
@@ -319,101 +403,121 @@ class ClickHouseConnector(DatabaseConnector):
                     str(new_record.get('config_snapshot', '')),
                     new_record.get('created_at')
                 ]
-                self.client.insert('pipeline_runs', [data_to_insert], column_names=column_names)
+                self.client.insert('pipeline_runs', [data_to_insert], column_names=column_names,
+                                   column_type_names=self._get_column_type_names('pipeline_runs', column_names))
 
             return True
         except Exception as e:
             print(f"Error logging pipeline run end to ClickHouse: {e}")
             return False
 
-    def fetch_interactions(self, limit: Optional[int] = None) -> List[Dict]:
-        """Fetch interactions, optionally limited by count."""
+    def _query_records(self, query: str, parameters: Optional[Dict] = None, datetime_keys=()) -> List[Dict]:
+        """Run a query and return rows as dicts, with the datetime_keys columns as ISO strings."""
+        result = self.client.query(query, parameters=parameters, column_oriented=True)
+        column_names = result.column_names
+        columns = list(result.result_columns)
+        # Convert only the datetime_keys columns, one column at a time
+        for i, name in enumerate(column_names):
+            if name in datetime_keys:
+                columns[i] = [value.isoformat() if isinstance(value, datetime) else value for value in columns[i]]
+        return [dict(zip(column_names, row)) for row in zip(*columns)]
+
+    def fetch_interactions(self, limit: Optional[int] = None, customer_ids: Optional[List[str]] = None) -> List[Dict]:
+        """Fetch interactions, optionally only for the given customers and limited by count."""
         try:
+            if customer_ids is not None:
+                # Bind parameters travel in the request URL, so ids go through the chunked bulk fetch
+                interactions = [
+                    interaction
+                    for customer_interactions in self.fetch_customer_interactions_bulk(customer_ids).values()
+                    for interaction in customer_interactions
+                ]
+                return interactions[:limit] if limit is not None else interactions
             query = "SELECT * FROM interactions"
             if limit is not None:
                 query += f" LIMIT {limit}"
-            result = self.client.query(query)
-            if not result.result_rows:
-                return []
-            columns = result.column_names
-            return [dict(zip(columns, row)) for row in result.result_rows]
+            return self._query_records(query)
         except Exception as e:
             print(f"Error fetching interactions from ClickHouse: {e}")
             return []
 
-    def fetch_customer_profiles(self, limit: Optional[int] = None) -> List[Dict]:
-        """Fetch customer profiles, optionally limited by count."""
+    def iter_interactions_df(self, columns: Optional[List[str]] = None, chunksize: int = 100_000) -> Iterator[pd.DataFrame]:
+        """Stream interactions as DataFrames of about chunksize rows (one per ClickHouse block).
+
+        Errors propagate, so a stream that fails partway is never mistaken for the end of the table.
+        """
+        query = f"SELECT {', '.join(columns) if columns else '*'} FROM interactions"
+        with self.client.query_df_stream(query, settings={'max_block_size': chunksize}) as stream:
+            for df in stream:
+                yield df
+
+    def fetch_customer_profiles(self, limit: Optional[int] = None, exclude_resolved: bool = False) -> List[Dict]:
+        """Fetch customer profiles, optionally without resolved customers and limited by count."""
         try:
             query = "SELECT * FROM customer_profiles"
+            if exclude_resolved:
+                query += " WHERE customer_id NOT IN (SELECT customer_id FROM conversations WHERE resolution_status = 'resolved')"
             if limit is not None:
                 query += f" LIMIT {limit}"
-            result = self.client.query(query)
-            if not result.result_rows:
-                return []
-            columns = result.column_names
-            profiles = []
-            for row in result.result_rows:
-                record = dict(zip(columns, row))
-                # Convert datetime fields to ISO strings
-                for key in ['last_interaction_timestamp', 'created_at']:
-                    if key in record and isinstance(record[key], datetime):
-                        record[key] = record[key].isoformat()
-                profiles.append(record)
-            return profiles
+            return self._query_records(query, datetime_keys=('last_interaction_timestamp', 'created_at'))
         except Exception as e:
             print(f"Error fetching customer profiles: {e}")
             return []
     def fetch_customer_profile(self, customer_id: str) -> Dict:
         try:
-            query = f"SELECT * FROM customer_profiles WHERE customer_id = '{customer_id}'"
-            result = self.client.query(query)
-            if not result.result_rows:
-                return None
-            columns = result.column_names
-            record = dict(zip(columns, result.result_rows[0]))
-            # Convert datetime fields to ISO strings
-            for key in ['last_interaction_timestamp', 'created_at']:
-                if key in record and isinstance(record[key], datetime):
-                    record[key] = record[key].isoformat()
-            return record
+            query = "SELECT * FROM customer_profiles WHERE customer_id = {customer_id:String}"
+            records = self._query_records(query, parameters={'customer_id': customer_id},
+                                          datetime_keys=('last_interaction_timestamp', 'created_at'))
+            return records[0] if records else None
         except Exception as e:
             print(f"Error fetching customer profile: {e}")
             return None
     def fetch_customer_interactions(self, customer_id: str) -> List[Dict]:
         try:
-            query = f"SELECT * FROM interactions WHERE participant_external_id = '{customer_id}' ORDER BY interaction_timestamp ASC"
-            result = self.client.query(query)
-            if not result.result_rows:
-                return []
-            columns = result.column_names
-            interactions = []
-            for row in result.result_rows:
-                record = dict(zip(columns, row))
-                # Convert datetime fields to ISO strings
-                for key in ['interaction_timestamp', 'created_at']:
-                    if key in record and isinstance(record[key], datetime):
-                        record[key] = record[key].isoformat()
-                interactions.append(record)
-            return interactions
+            query = "SELECT * FROM interactions WHERE participant_external_id = {customer_id:String} ORDER BY interaction_timestamp ASC"
+            return self._query_records(query, parameters={'customer_id': customer_id},
+                                       datetime_keys=('interaction_timestamp', 'created_at'))
         except Exception as e:
             print(f"Error fetching customer interactions: {e}")
             return []
     def fetch_customer_conversation(self, customer_id: str) -> Dict:
         try:
-            query = f"SELECT * FROM conversations WHERE customer_id = '{customer_id}'"
-            result = self.client.query(query)
-            if not result.result_rows:
-                return None
-            columns = result.column_names
-            record = dict(zip(columns, result.result_rows[0]))
-            # Convert datetime fields to ISO strings
-            for key in ['conversation_start_timestamp', 'conversation_end_timestamp', 'created_at']:
-                if key in record and isinstance(record[key], datetime):
-                    record[key] = record[key].isoformat()
-            return record
+            query = "SELECT * FROM conversations WHERE customer_id = {customer_id:String}"
+            records = self._query_records(query, parameters={'customer_id': customer_id},
+                                          datetime_keys=('conversation_start_timestamp', 'conversation_end_timestamp', 'created_at'))
+            return records[0] if records else None
         except Exception as e:
             print(f"Error fetching customer conversation: {e}")
             return None
+    def fetch_customer_conversations_bulk(self, customer_ids: List[str]) -> Dict[str, Dict]:
+        """Fetch conversation summaries for many customers, keyed by customer_id."""
+        conversations = {}
+        try:
+            query = "SELECT * FROM conversations WHERE customer_id IN {customer_ids:Array(String)}"
+            customer_ids = list(customer_ids)
+            for i in range(0, len(customer_ids), BULK_FETCH_CHUNK_SIZE):
+                records = self._query_records(query, parameters={'customer_ids': customer_ids[i:i + BULK_FETCH_CHUNK_SIZE]},
+                                              datetime_keys=('conversation_start_timestamp', 'conversation_end_timestamp', 'created_at'))
+                for record in records:
+                    conversations.setdefault(record['customer_id'], record)
+        except Exception as e:
+            print(f"Error fetching customer conversations: {e}")
+        return conversations
+    def fetch_customer_interactions_bulk(self, customer_ids: List[str]) -> Dict[str, List[Dict]]:
+        """Fetch interactions for many customers, keyed by customer_id and ordered by timestamp."""
+        interactions = {}
+        try:
+            query = ("SELECT * FROM interactions WHERE participant_external_id IN {customer_ids:Array(String)} "
+                     "ORDER BY participant_external_id, interaction_timestamp ASC")
+            customer_ids = list(customer_ids)
+            for i in range(0, len(customer_ids), BULK_FETCH_CHUNK_SIZE):
+                records = self._query_records(query, parameters={'customer_ids': customer_ids[i:i + BULK_FETCH_CHUNK_SIZE]},
+                                              datetime_keys=('interaction_timestamp', 'created_at'))
+                for record in records:
+                    interactions.setdefault(record['participant_external_id'], []).append(record)
+        except Exception as e:
+            print(f"Error fetching customer interactions: {e}")
+        return interactions
     def batch_insert_conversations(self, records: List[Dict]) -> bool:
         try:
             processed_records = []
@@ -448,7 +552,8 @@ class ClickHouseConnector(DatabaseConnector):
                     record.get('created_at')
                 ]
                 data_to_insert.append(row)
-            self.client.insert('conversations', data_to_insert, column_names=column_names)
+            self.client.insert('conversations', data_to_insert, column_names=column_names,
+                               column_type_names=self._get_column_type_names('conversations', column_names))
             return True
         except Exception as e:
             print(f"Error batch inserting conversations to ClickHouse: {e}")
@@ -490,7 +595,8 @@ class ClickHouseConnector(DatabaseConnector):
                     record.get('created_at')
                 ]
                 data_to_insert.append(row)
-            self.client.insert('customer_profiles', data_to_insert, column_names=column_names)
+            self.client.insert('customer_profiles', data_to_insert, column_names=column_names,
+                               column_type_names=self._get_column_type_names('customer_profiles', column_names))
             return True
         except Exception as e:
             print(f"Error batch inserting customer profiles to ClickHouse: {e}")
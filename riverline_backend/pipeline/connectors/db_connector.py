@@ -26,3 +26,6 @@ class DatabaseConnector(ABC):
     @abstractmethod
     def health_check(self) -> bool:
         pass
+
+    def close(self):
+        pass
@@ -1,12 +1,17 @@
 
-from typing import List, Dict, Optional
+from typing import List, Dict, Optional, Iterator, Set
 from supabase import create_client, Client
 from postgrest import APIResponse
 from .db_connector import DatabaseConnector
 import json
+import pandas as pd
 from datetime import datetime
+from operator import itemgetter
 import uuid
 
+# Max ids per .in_() filter; PostgREST filters travel in the request URL
+IN_FILTER_CHUNK_SIZE = 200
+
 class SupabaseConnector(DatabaseConnector):
     def __init__(self, url: str, key: str, batch_size: int = 1000):
         self.client: Client = create_client(url, key)
@@ -134,6 +139,31 @@ class SupabaseConnector(DatabaseConnector):
         # Implementation for health check
         pass
 
+    def fetch_interactions(self, limit: Optional[int] = None, customer_ids: Optional[List[str]] = None) -> List[Dict]:
+        try:
+            if customer_ids is None:
+                if limit is not None:
+                    return self.client.table('interactions').select('*').limit(limit).execute().data
+                return self._fetch_all_pages(lambda: self.client.table('interactions').select('*'), 'interaction_id')
+            interactions = [
+                interaction
+                for customer_interactions in self.fetch_customer_interactions_bulk(customer_ids).values()
+                for interaction in customer_interactions
+            ]
+            return interactions[:limit] if limit is not None else interactions
+        except Exception as e:
+            print(f"Error fetching interactions: {e}")
+            return []
+
+    def iter_interactions_df(self, columns: Optional[List[str]] = None, chunksize: int = 1000) -> Iterator[pd.DataFrame]:
+        # Keyset pages on interaction_id, which is selected even when columns leave it out;
+        # errors propagate, so a failed page never looks like the end of the table to the caller
+        selected = '*'
+        if columns:
+            selected = ','.join(columns if 'interaction_id' in columns else columns + ['interaction_id'])
+        for page in self._iter_pages(lambda: self.client.table('interactions').select(selected), 'interaction_id', chunksize):
+            yield pd.DataFrame(page, columns=columns)
+
     def fetch_customer_interactions(self, customer_id: str) -> List[Dict]:
         try:
             response = self.client.table('interactions').select('*').eq('participant_external_id', customer_id).order('interaction_timestamp', desc=False).execute()
@@ -142,6 +172,58 @@ class SupabaseConnector(DatabaseConnector):
             print(f"Error fetching interactions: {e}")
             return []
 
+    def _iter_pages(self, build_query, key: str, page_size: Optional[int] = None) -> Iterator[List[Dict]]:
+        # PostgREST silently truncates responses at its max-rows setting (1000 on Supabase by default),
+        # so read in pages ordered by key, each starting after the last key seen. The server finds that
+        # point through the key's index, so every page costs the same however deep into the table it is.
+        # key must be unique and among the selected columns.
+        page_size = page_size or self.batch_size
+        last_key = None
+        while True:
+            query = build_query().order(key)
+            if last_key is not None:
+                query = query.gt(key, last_key)
+            page = query.limit(page_size).execute().data
+            if page:
+                yield page
+            if len(page) < page_size:
+                return
+            last_key = page[-1][key]
+
+    def _fetch_all_pages(self, build_query, key: str) -> List[Dict]:
+        return [record for page in self._iter_pages(build_query, key) for record in page]
+
+    def fetch_customer_conversations_bulk(self, customer_ids: List[str]) -> Dict[str, Dict]:
+        conversations = {}
+        try:
+            customer_ids = list(customer_ids)
+            for i in range(0, len(customer_ids), IN_FILTER_CHUNK_SIZE):
+                chunk = customer_ids[i:i + IN_FILTER_CHUNK_SIZE]
+                records = self._fetch_all_pages(
+                    lambda: self.client.table('conversations').select('*').in_('customer_id', chunk), 'conversation_id')
+                for record in records:
+                    conversations.setdefault(record['customer_id'], record)
+        except Exception as e:
+            print(f"Error fetching customer conversations: {e}")
+        return conversations
+
+    def fetch_customer_interactions_bulk(self, customer_ids: List[str]) -> Dict[str, List[Dict]]:
+        interactions = {}
+        try:
+            customer_ids = list(customer_ids)
+            for i in range(0, len(customer_ids), IN_FILTER_CHUNK_SIZE):
+                chunk = customer_ids[i:i + IN_FILTER_CHUNK_SIZE]
+                records = self._fetch_all_pages(
+                    lambda: self.client.table('interactions').select('*').in_('participant_external_id', chunk), 'interaction_id')
+                for record in records:
+                    interactions.setdefault(record['participant_external_id'], []).append(record)
+            # Pages come back in interaction_id order; each history is put back in time order
+            for customer_interactions in interactions.values():
+                customer_interactions.sort(key=itemgetter('interaction_timestamp', 'interaction_id'))
+        except Exception as e:
+            print(f"Error fetching interactions: {e}")
+        return interactions
+
     def log_pipeline_run_start(self, run_data: Dict) -> str:
         try:
             processed_run_data = run_data.copy()
@@ -172,10 +254,35 @@ class SupabaseConnector(DatabaseConnector):
             print(f"Error logging pipeline run end: {e}")
             return False
 
-    def fetch_customer_profiles(self) -> List[Dict]:
+    def fetch_customer_profiles(self, limit: Optional[int] = None, exclude_resolved: bool = False) -> List[Dict]:
         try:
-            response = self.client.table('customer_profiles').select('*').execute()
-            return response.data
+            if not exclude_resolved:
+                query = self.client.table('customer_profiles').select('*')
+                if limit is not None:
+                    query = query.limit(limit)
+                response = query.execute()
+                return response.data
+
+            # No foreign key to anti-join on through PostgREST: page through profiles and drop the
+            # customers that have a resolved conversation, looked up for each page's ids only
+            page_size = min(self.batch_size, limit) if limit is not None else self.batch_size
+            customer_profiles = []
+            for page in self._iter_pages(lambda: self.client.table('customer_profiles').select('*'), 'customer_id', page_size):
+                resolved_customer_ids = self._fetch_resolved_customer_ids([record['customer_id'] for record in page])
+                customer_profiles.extend(record for record in page if record['customer_id'] not in resolved_customer_ids)
+                if limit is not None and len(customer_profiles) >= limit:
+                    break
+            return customer_profiles[:limit] if limit is not None else customer_profiles
         except Exception as e:
             print(f"Error fetching customer profiles: {e}")
             return []
+
+    def _fetch_resolved_customer_ids(self, customer_ids: List[str]) -> Set[str]:
+        resolved_customer_ids = set()
+        for i in range(0, len(customer_ids), IN_FILTER_CHUNK_SIZE):
+            chunk = customer_ids[i:i + IN_FILTER_CHUNK_SIZE]
+            resolved_conversations = self._fetch_all_pages(
+                lambda: self.client.table('conversations').select('conversation_id,customer_id')
+                .in_('customer_id', chunk).eq('resolution_status', 'resolved'), 'conversation_id')
+            resolved_customer_ids.update(record['customer_id'] for record in resolved_conversations)
+        return resolved_customer_ids
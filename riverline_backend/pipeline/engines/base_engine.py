@@ -1,6 +1,6 @@
 
 from abc import ABC, abstractmethod
-from typing import List, Dict, Optional
+from typing import List, Dict, Optional, Iterator
 import pandas as pd
 
 class BaseDataEngine(ABC):
@@ -17,5 +17,5 @@ class BaseDataEngine(ABC):
         pass
     
     @abstractmethod
-    def get_records(self, df: pd.DataFrame) -> List[Dict]:
+    def get_records(self, df: pd.DataFrame, chunk_size: int = 100_000) -> Iterator[List[Dict]]:
         pass
@@ -1,9 +1,20 @@
 
+import numpy as np
 import pandas as pd
-from typing import List, Dict, Optional
-import uuid
+from typing import List, Dict, Optional, Iterator
+import re
 
 from .base_engine import BaseDataEngine
+from helpers.general_utils import bulk_uuid4
+
+# URLs, @mentions and #hashtags stripped from content_text in a single pass
+NOISE_PATTERN = re.compile(r'http\S+|@\S+|#\S+', re.IGNORECASE)
+
+# Only the CSV columns normalize_data maps onto the interaction schema
+CSV_COLUMNS = ['tweet_id', 'author_id', 'created_at', 'text']
+
+# Rows per read_csv chunk on incremental runs
+CSV_CHUNK_SIZE = 200_000
 
 class PandasDataEngine(BaseDataEngine):
     def __init__(self):
@@ -11,37 +22,37 @@ class PandasDataEngine(BaseDataEngine):
 
     def read_data(self, file_path: str, last_processed_timestamp: Optional[str] = None) -> pd.DataFrame:
         try:
-            df = pd.read_csv(file_path, encoding='latin-1')
-            if last_processed_timestamp:
-                print(f"Filtering data with last_processed_timestamp: {last_processed_timestamp}")
-                df['created_at'] = pd.to_datetime(df['created_at'], format="%a %b %d %H:%M:%S %z %Y", utc=True, errors='coerce')
-                df = df[df['created_at'] > pd.to_datetime(last_processed_timestamp, utc=True)]
-                print(f"DataFrame size after filtering in read_data: {len(df)}")
+            if not last_processed_timestamp:
+                return pd.read_csv(file_path, encoding='latin-1', usecols=CSV_COLUMNS)
+
+            print(f"Filtering data with last_processed_timestamp: {last_processed_timestamp}")
+            # Filter chunk by chunk so only rows past the watermark are ever held in memory at once
+            last_processed = pd.to_datetime(last_processed_timestamp, utc=True)
+            kept_chunks = []
+            for chunk in pd.read_csv(file_path, encoding='latin-1', usecols=CSV_COLUMNS, chunksize=CSV_CHUNK_SIZE):
+                chunk['created_at'] = pd.to_datetime(chunk['created_at'], format="%a %b %d %H:%M:%S %z %Y", utc=True, errors='coerce')
+                kept_chunks.append(chunk[chunk['created_at'] > last_processed])
+            df = pd.concat(kept_chunks) if kept_chunks else pd.DataFrame(columns=CSV_COLUMNS)
+            print(f"DataFrame size after filtering in read_data: {len(df)}")
             return df
         except FileNotFoundError:
             raise Exception(f"File not found at {file_path}")
 
     def normalize_data(self, df: pd.DataFrame) -> pd.DataFrame:
-        df['interaction_timestamp'] = pd.to_datetime(df['created_at'], format="%a %b %d %H:%M:%S %z %Y", utc=True).dt.strftime('%Y-%m-%dT%H:%M:%SZ')
-        df['platform_type'] = 'twitter'
-        df['interaction_type'] = 'tweet'
-        df['interaction_id'] = [str(uuid.uuid4()) for _ in range(len(df))]
-        df_normalized = df.rename(columns={
-            'tweet_id': 'external_id',
-            'author_id': 'participant_external_id',
-            'text': 'content_text',
-        })
-
-        # Select and reorder columns to match UniversalInteraction schema
-        df_normalized = df_normalized[[
-            'interaction_id',
-            'external_id',
-            'platform_type',
-            'participant_external_id',
-            'content_text',
-            'interaction_timestamp',
-            'interaction_type',
-        ]]
+        n = len(df)
+        interaction_timestamps = pd.to_datetime(df['created_at'], format="%a %b %d %H:%M:%S %z %Y", utc=True)
+        # Build the UniversalInteraction-shaped frame directly from the source columns,
+        # copying each needed column once and leaving df untouched
+        df_normalized = pd.DataFrame({
+            'interaction_id': bulk_uuid4(n),
+            'external_id': df['tweet_id'],
+            # Constant low-cardinality columns stored as categoricals (one int8 code per row)
+            'platform_type': pd.Categorical.from_codes(np.zeros(n, dtype=np.int8), categories=['twitter']),
+            'participant_external_id': df['author_id'],
+            'content_text': df['text'],
+            'interaction_timestamp': interaction_timestamps.dt.strftime('%Y-%m-%dT%H:%M:%SZ'),
+            'interaction_type': pd.Categorical.from_codes(np.zeros(n, dtype=np.int8), categories=['tweet']),
+        }, index=df.index)
         return df_normalized
 
     def quality_check(self, df: pd.DataFrame) -> pd.DataFrame:
@@ -52,11 +63,11 @@ class PandasDataEngine(BaseDataEngine):
         df = df.dropna(subset=['content_text'])
 
         # Basic text cleaning
-        df['content_text'] = df['content_text'].str.replace(r'http\S+', '', case=False, regex=True)
-        df['content_text'] = df['content_text'].str.replace(r'@\S+', '', case=False, regex=True)
-        df['content_text'] = df['content_text'].str.replace(r'#\S+', '', case=False, regex=True)
+        df['content_text'] = df['content_text'].str.replace(NOISE_PATTERN, '', regex=True)
 
         return df
 
-    def get_records(self, df: pd.DataFrame) -> List[Dict]:
-        return df.to_dict('records')
+    def get_records(self, df: pd.DataFrame, chunk_size: int = 100_000) -> Iterator[List[Dict]]:
+        # Convert chunk by chunk so only chunk_size rows exist as Python dicts at a time
+        for start in range(0, len(df), chunk_size):
+            yield df.iloc[start:start + chunk_size].to_dict('records')